@@ -1,6 +1,7 @@
+import functools
 import grpc
-import pickle
 import sys, os
+import numpy as np
 
 SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
 PROJECT_ROOT = os.path.abspath(os.path.join(SCRIPT_DIR, '..', '..'))
@@ -8,53 +9,77 @@ sys.path.append(PROJECT_ROOT)
 
 import recognition_pb2
 import recognition_pb2_grpc
-from engine.data_models import NormalizedKanji
+from engine.data_models import NormalizedKanji, STROKE_FEATURES_DTYPE
+from engine.storage import load_database
+
+SERVER_ADDRESS = 'localhost:50051'
+
+# Опции канала: keepalive держит соединение открытым между вызовами,
+# явный лимит ответа вместо значения по умолчанию
+CHANNEL_OPTIONS = [
+    ('grpc.keepalive_time_ms', 30000),
+    ('grpc.max_receive_message_length', 1_000_000),
+]
+
+@functools.lru_cache(maxsize=None)
+def _get_stub(address: str = SERVER_ADDRESS) -> recognition_pb2_grpc.RecognitionServiceStub:
+    """Один канал и stub на процесс, чтобы не устанавливать соединение заново при каждом вызове."""
+    # Запросы маленькие, сжатие только тратит CPU
+    channel = grpc.insecure_channel(address, options=CHANNEL_OPTIONS, compression=grpc.Compression.NoCompression)
+    return recognition_pb2_grpc.RecognitionServiceStub(channel)
 
 def run_client(kanji_to_test: NormalizedKanji):
     """Запускает gRPC клиент и отправляет запрос на распознавание."""
     print("--- gRPC Client ---")
-    with grpc.insecure_channel('localhost:50051') as channel:
-        stub = recognition_pb2_grpc.RecognitionServiceStub(channel)
-        
-        request = recognition_pb2.RecognitionRequest(top_n=5)
-        
-        for stroke in kanji_to_test.normalized_strokes:
-            grpc_stroke = request.normalized_strokes.add()
-            for p in stroke:
-                grpc_stroke.points.add(x=p[0], y=p[1])
-
-        for f in kanji_to_test.stroke_features:
-            grpc_features = request.stroke_features.add()
-            grpc_features.length = f.length
-            grpc_features.start_point.x, grpc_features.start_point.y = f.start_point
-            grpc_features.end_point.x, grpc_features.end_point.y = f.end_point
-            grpc_features.centroid.x, grpc_features.centroid.y = f.centroid
-            (min_x, min_y), (max_x, max_y) = f.bounding_box
-            grpc_features.bounding_box.min.x, grpc_features.bounding_box.min.y = min_x, min_y
-            grpc_features.bounding_box.max.x, grpc_features.bounding_box.max.y = max_x, max_y
-
-        (min_x, min_y), (max_x, max_y) = kanji_to_test.global_bounding_box
-        request.global_bounding_box.min.x, request.global_bounding_box.min.y = min_x, min_y
-        request.global_bounding_box.max.x, request.global_bounding_box.max.y = max_x, max_y
-        request.global_centroid.x, request.global_centroid.y = kanji_to_test.global_centroid
-
-        print(f"Sending request to recognize kanji '{kanji_to_test.character}'...")
-        response = stub.Recognize(request)
-
-        print("\n--- Recognition Results ---")
-        if not response.results:
-            print("No results returned.")
-        for res in response.results:
-            print(
-                f"Character: {res.character}\t "
-                f"Distance: {res.distance:.2f}\t "
-                f"Confidence: {res.confidence:.2%}"
-            )
+    stub = _get_stub()
+    
+    request = recognition_pb2.RecognitionRequest(top_n=5)
+    
+    # Геометрия и фичи уходят двумя сырыми float32-буферами, без сообщения на каждую точку.
+    # Буферы выделяются один раз под итоговый размер и заполняются на месте
+    lengths = [len(s) for s in kanji_to_test.normalized_strokes]
+    request.stroke_lengths.extend(lengths)
+    points = np.empty((sum(lengths), 2), dtype='<f4')
+    offset = 0
+    for stroke, length in zip(kanji_to_test.normalized_strokes, lengths):
+        if length:
+            points[offset:offset + length] = stroke
+        offset += length
+    request.strokes_blob = points.tobytes()
+
+    stroke_features = kanji_to_test.stroke_features
+    features = np.empty(len(stroke_features), dtype=STROKE_FEATURES_DTYPE)
+    if stroke_features:
+        features['length'] = [f.length for f in stroke_features]
+        features['start'] = [f.start_point for f in stroke_features]
+        features['end'] = [f.end_point for f in stroke_features]
+        features['centroid'] = [f.centroid for f in stroke_features]
+        features['bbox_min'] = [f.bounding_box[0] for f in stroke_features]
+        features['bbox_max'] = [f.bounding_box[1] for f in stroke_features]
+    request.stroke_features_blob = features.tobytes()
+
+    (min_x, min_y), (max_x, max_y) = kanji_to_test.global_bounding_box
+    request.global_bounding_box.min.x, request.global_bounding_box.min.y = min_x, min_y
+    request.global_bounding_box.max.x, request.global_bounding_box.max.y = max_x, max_y
+    request.global_centroid.x, request.global_centroid.y = kanji_to_test.global_centroid
+
+    print(f"Sending request to recognize kanji '{kanji_to_test.character}'...")
+    # Ограничение по времени, чтобы клиент не зависал на недоступном сервере
+    response = stub.Recognize(request, timeout=5.0)
+
+    print("\n--- Recognition Results ---")
+    if not response.results:
+        print("No results returned.")
+    for res in response.results:
+        print(
+            f"Character: {res.character}\t "
+            f"Distance: {res.distance:.2f}\t "
+            f"Confidence: {res.confidence:.2%}"
+        )
 
 if __name__ == '__main__':
     db_path = os.path.join(PROJECT_ROOT, 'assets', 'kanjivg_normalized.pkl')
-    with open(db_path, 'rb') as f:
-        db = pickle.load(f)
+    db = load_database(db_path)
     
     test_kanji_char = '猫' 
     if test_kanji_char in db:
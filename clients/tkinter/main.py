@@ -1,6 +1,5 @@
 import tkinter as tk
 from tkinter import ttk, messagebox
-import pickle
 import os
 import sys
 import numpy as np
@@ -13,6 +12,7 @@ sys.path.append(PROJECT_ROOT)
 try:
     from engine.data_models import NormalizedKanji, NormalizedStroke
     from engine.matcher import Matcher
+    from engine.storage import load_database
     from engine.preprocessor import _normalize_kanji, _calculate_stroke_features
 except ImportError as e:
     print(f"Ошибка: Не удалось импортировать компоненты движка: {e}")
@@ -61,11 +61,10 @@ class KanjiPadApp:
                 f"Файл базы данных не найден: {self.DATABASE_PATH}\n"
                 "Запустите preprocessor.py для его создания."
             )
-        with open(self.DATABASE_PATH, 'rb') as f:
-            db = pickle.load(f)
-            if not db:
-                raise RuntimeError("База данных пуста. Проверьте работу preprocessor.py.")
-            return db
+        db = load_database(self.DATABASE_PATH)
+        if not db:
+            raise RuntimeError("База данных пуста. Проверьте работу preprocessor.py.")
+        return db
 
     def _setup_ui(self):
         """Создает и размещает все элементы интерфейса."""
@@ -209,7 +208,7 @@ class KanjiPadApp:
             stroke_features=stroke_features,
             global_bounding_box=global_box,
             global_centroid=global_centroid,
-            source_component_tree=None # type: ignore
+            source_component_tree=None
         )
 
         # 2. Передаем объект в матчер
@@ -244,14 +243,16 @@ class KanjiPadApp:
         if not self.current_kanji_to_view: return
         for i in range(self.current_stroke_index):
             stroke = self.current_kanji_to_view.normalized_strokes[i]
-            scaled_points = [p * self.scale_factor for xy in stroke for p in xy]
+            # Штрихи баз старого формата - списки кортежей, поэтому приводятся к массиву
+            scaled_points = (np.asarray(stroke, dtype=np.float32) * self.scale_factor).ravel().tolist()
             if len(scaled_points) >= 4:
                 self.canvas.create_line(scaled_points, fill="black", width=3, capstyle="round")
 
 def _get_global_features(all_strokes: list[NormalizedStroke]):
     # Вспомогательная функция
-    if not all_strokes or not any(stroke for stroke in all_strokes): return (((0,0),(0,0)),(0,0))
-    all_points = np.array([point for stroke in all_strokes for point in stroke])
+    if not all_strokes: return (((0,0),(0,0)),(0,0))
+    # Одна склейка массивов вместо поточечного обхода всех штрихов в Python
+    all_points = np.concatenate([np.asarray(stroke, dtype=np.float64).reshape(-1, 2) for stroke in all_strokes])
     if all_points.size == 0: return (((0,0),(0,0)),(0,0))
     min_c, max_c = all_points.min(axis=0), all_points.max(axis=0)
     return ((tuple(min_c), tuple(max_c)), tuple(all_points.mean(axis=0)))
@@ -2,10 +2,11 @@
 
 from dataclasses import dataclass, field
 from typing import TypeAlias, Tuple
+import numpy as np
 
 Point: TypeAlias = Tuple[float, float]
 BoundingBox: TypeAlias = Tuple[Point, Point]  # ((min_x, min_y), (max_x, max_y))
-NormalizedStroke: TypeAlias = list[Point]
+NormalizedStroke: TypeAlias = np.ndarray  # (N, 2) float32 - точки штриха (x, y)
 
 
 @dataclass(frozen=True)
@@ -37,6 +38,17 @@ class StrokeFeatures:
     # Суммарная длина штриха.
     length: float
 
+# Бинарная раскладка одной записи StrokeFeatures (little-endian float32).
+# Используется для передачи фич одним буфером в gRPC (stroke_features_blob).
+STROKE_FEATURES_DTYPE = np.dtype([
+    ('length', '<f4'),
+    ('start', '<f4', (2,)),
+    ('end', '<f4', (2,)),
+    ('centroid', '<f4', (2,)),
+    ('bbox_min', '<f4', (2,)),
+    ('bbox_max', '<f4', (2,)),
+])
+
 @dataclass(frozen=True)
 class NormalizedKanji:
     """
@@ -56,8 +68,8 @@ class NormalizedKanji:
     global_bounding_box: BoundingBox
     global_centroid: Point
     
-    # Полное дерево компонентов
-    source_component_tree: KanjiComponent
+    # Полное дерево компонентов (None в рабочей базе и во вводе пользователя, см. full_database_path)
+    source_component_tree: KanjiComponent | None
 
     @property
     def stroke_count(self) -> int:
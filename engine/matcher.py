@@ -1,10 +1,16 @@
-import pickle
+import os
+import threading
+from contextlib import nullcontext
+import numba
 import numpy as np
+from numba import njit, prange
 from scipy.optimize import linear_sum_assignment
 from .data_models import NormalizedKanji, RecognitionResult
+from .storage import load_database
 
 POINTS_PER_STROKE = 32 # Количество точек для ресемплинга каждого штриха
 MAX_STROKES_IN_DB = 35 # Максимальное число штрихов в базе данных
+DB_COORD_SCALE = 32767 # Масштаб фиксированной точки: координаты [0, 1] хранятся в db_strokes как int16
 
 W_SHAPE = 1.0       # Вес для формы штриха     
 W_POSITION = 2.5    # Вес для позиции штриха
@@ -13,23 +19,317 @@ W_SIZE = 1.5        # Вес для размера штриха
 # Штраф за каждый лишний штрих в кандидате (для режима предикшна)
 STROKE_COUNT_PENALTY = 0.15 
 
+# Сколько кандидатов с наименьшей нижней оценкой считается точно до отсечения остальных (см. Matcher._calculate_top_costs)
+BOUND_FIRST_BLOCK = 64
+
+# Общая блокировка параллельных ядер для слоя потоков numba workqueue (см. Matcher._parallel_kernel_guard)
+_WORKQUEUE_LOCK = threading.Lock()
+
+# Версия формата .npz-кэша тензоров; увеличивать при изменении состава или раскладки массивов
+TENSOR_CACHE_VERSION = 4
+
+@njit(cache=True, nogil=True)
+def _resample_into(stroke, out):
+    """
+    Ресемплинг штриха равномерно по длине дуги.
+
+    :param stroke: Массив Nx2 точек штриха.
+    :param out: Выходной массив n x 2, заполняется на месте.
+    """
+    n_in = stroke.shape[0]
+    n = out.shape[0]
+    if n_in == 0:
+        raise ValueError("Cannot resample an empty stroke")
+    if n_in == n:
+        out[:] = stroke
+        return
+
+    cum_dist = np.empty(n_in)
+    cum_dist[0] = 0.0
+    for i in range(1, n_in):
+        dx = stroke[i, 0] - stroke[i - 1, 0]
+        dy = stroke[i, 1] - stroke[i - 1, 1]
+        cum_dist[i] = cum_dist[i - 1] + np.sqrt(dx * dx + dy * dy)
+    total_len = cum_dist[n_in - 1]
+
+    if total_len == 0:
+        for j in range(n):
+            out[j, 0] = stroke[0, 0]
+            out[j, 1] = stroke[0, 1]
+        return
+
+    seg = 0
+    for j in range(n):
+        t = total_len * j / (n - 1) if n > 1 else 0.0
+        while seg < n_in - 2 and cum_dist[seg + 1] <= t:
+            seg += 1
+        seg_len = cum_dist[seg + 1] - cum_dist[seg]
+        frac = (t - cum_dist[seg]) / seg_len if seg_len > 0 else 0.0
+        out[j, 0] = stroke[seg, 0] + frac * (stroke[seg + 1, 0] - stroke[seg, 0])
+        out[j, 1] = stroke[seg, 1] + frac * (stroke[seg + 1, 1] - stroke[seg, 1])
+
+
+@njit(cache=True, nogil=True)
+def _normalize_into_unit_square(strokes):
+    """
+    Вписывание штрихов одного иероглифа в единичный квадрат с сохранением пропорций.
+
+    :param strokes: Массив (S, n, 2), изменяется на месте.
+    """
+    min_x, min_y = np.inf, np.inf
+    max_x, max_y = -np.inf, -np.inf
+    for s in range(strokes.shape[0]):
+        for j in range(strokes.shape[1]):
+            min_x = min(min_x, strokes[s, j, 0])
+            min_y = min(min_y, strokes[s, j, 1])
+            max_x = max(max_x, strokes[s, j, 0])
+            max_y = max(max_y, strokes[s, j, 1])
+    max_dim = max(max_x - min_x, max_y - min_y)
+    if max_dim == 0: max_dim = 1.0
+
+    for s in range(strokes.shape[0]):
+        for j in range(strokes.shape[1]):
+            strokes[s, j, 0] = (strokes[s, j, 0] - min_x) / max_dim
+            strokes[s, j, 1] = (strokes[s, j, 1] - min_y) / max_dim
+
+
+@njit(cache=True, nogil=True)
+def _resample_and_normalize_into(flat_points, stroke_offsets, out):
+    """
+    Ресемплинг и нормализация геометрии всех штрихов одного иероглифа.
+
+    :param flat_points: Точки всех штрихов подряд, массив (P, 2).
+    :param stroke_offsets: Границы штрихов в flat_points, массив (S + 1,).
+    :param out: Выходной массив (S, n, 2), заполняется на месте и вписывается в единичный квадрат.
+
+    * Примечание: Одна и та же функция готовит и штрихи базы, и штрихи пользователя.
+    """
+    for s in range(out.shape[0]):
+        _resample_into(flat_points[stroke_offsets[s]:stroke_offsets[s + 1]], out[s])
+    _normalize_into_unit_square(out)
+
+
+@njit(cache=True, nogil=True, parallel=True)
+def _resample_and_normalize_batch(flat_points, stroke_offsets, kanji_offsets, n_out):
+    """
+    Ресемплинг и нормализация геометрии всех иероглифов базы за один вызов.
+
+    :param flat_points: Точки всех штрихов всех иероглифов подряд, массив (P, 2).
+    :param stroke_offsets: Границы штрихов в flat_points, массив (S + 1,).
+    :param kanji_offsets: Границы иероглифов в списке штрихов, массив (N + 1,).
+    :param n_out: Количество точек на штрих после ресемплинга.
+    :return: Массив (S, n_out, 2) float32; штрихи каждого иероглифа вписаны в единичный квадрат.
+
+    * Примечание: Иероглифы независимы и обрабатываются параллельно (prange) без GIL.
+    """
+    out = np.empty((len(stroke_offsets) - 1, n_out, 2), dtype=np.float32)
+    for k in prange(len(kanji_offsets) - 1):
+        first, last = kanji_offsets[k], kanji_offsets[k + 1]
+        _resample_and_normalize_into(flat_points, stroke_offsets[first:last + 1], out[first:last])
+    return out
+
+
+@njit(cache=True, nogil=True, parallel=True)
+def _cost_tensor(u_points, u_features, db_strokes, db_features, first_rows, out):
+    """
+    Матрицы стоимости сопоставления штрихов пользователя со штрихами группы кандидатов.
+
+    :param u_points: Штрихи пользователя (M, 32, 2) float32 в единицах DB_COORD_SCALE.
+    :param u_features: Фичи штрихов пользователя (M, 3).
+    :param db_strokes: Штрихи базы (S, 32, 2) int16.
+    :param db_features: Фичи штрихов базы (S, 3).
+    :param first_rows: Первая строка каждого кандидата в db_strokes (C,).
+    :param out: Выходной массив (C, M, K) float32; K - число штрихов у каждого кандидата группы.
+
+    * Примечание: Кандидаты независимы и считаются параллельно (prange). Метрика формы - сумма
+    расстояний между точками (минимум из прямого и обратного порядка), поэтому sqrt поточечный.
+    Суммы накапливаются во float64. Прямой и обратный порядок считаются в одном проходе:
+    точка p пользователя сравнивается с точками p и n_points - 1 - p штриха базы.
+    Как и остальные ядра модуля, компилируется с nogil=True: запросы из разных потоков сервера
+    считаются одновременно, а не по очереди за GIL (если слой потоков numba это допускает,
+    см. Matcher._parallel_kernel_guard).
+    """
+    n_candidates, n_user, n_db = out.shape
+    n_points = u_points.shape[1]
+    for c in prange(n_candidates):
+        for j in range(n_db):
+            row = first_rows[c] + j
+            for i in range(n_user):
+                dist_fwd = 0.0
+                dist_rev = 0.0
+                for p in range(n_points):
+                    dx = u_points[i, p, 0] - np.float32(db_strokes[row, p, 0])
+                    dy = u_points[i, p, 1] - np.float32(db_strokes[row, p, 1])
+                    dist_fwd += np.sqrt(dx * dx + dy * dy)
+                    dx = u_points[i, p, 0] - np.float32(db_strokes[row, n_points - 1 - p, 0])
+                    dy = u_points[i, p, 1] - np.float32(db_strokes[row, n_points - 1 - p, 1])
+                    dist_rev += np.sqrt(dx * dx + dy * dy)
+                dist_shape = min(dist_fwd, dist_rev) / DB_COORD_SCALE
+
+                # Позиционные и размерные различия
+                dx = u_features[i, 0] - db_features[row, 0]
+                dy = u_features[i, 1] - db_features[row, 1]
+                dist_pos = np.sqrt(dx * dx + dy * dy)
+                dist_size = abs(u_features[i, 2] - db_features[row, 2])
+
+                out[c, i, j] = dist_shape * W_SHAPE + dist_pos * W_POSITION + dist_size * W_SIZE
+
+
+@njit(cache=True, nogil=True, parallel=True)
+def _assignment_lower_bound(u_features, db_features, first_rows, counts, out):
+    """
+    Нижняя оценка суммарной стоимости оптимального сопоставления для каждого кандидата.
+
+    :param u_features: Фичи штрихов пользователя (M, 3).
+    :param db_features: Фичи штрихов базы (S, 3).
+    :param first_rows: Первая строка каждого кандидата в db_strokes (C,).
+    :param counts: Число штрихов каждого кандидата в db_strokes (C,).
+    :param out: Выходной массив (C,).
+
+    * Примечание: Сумма расстояний между 32 парами точек не меньше 32 расстояний между центроидами
+    (неравенство треугольника), поэтому стоимость пары штрихов не меньше
+    (32 * W_SHAPE + W_POSITION) * |dCentroid| + W_SIZE * |dLength|. Если M <= K, каждому штриху
+    пользователя достаётся свой штрих кандидата, и оценка - сумма минимумов по строкам;
+    если K <= M - сумма минимумов по столбцам. Оценка занижена на погрешность int16-геометрии
+    и округления float32 в матрице стоимости, чтобы не превышать точную стоимость.
+    """
+    n_user = u_features.shape[0]
+    w_centroid = POINTS_PER_STROKE * W_SHAPE + W_POSITION
+    # Округление геометрии базы до int16 сдвигает каждую точку меньше чем на 1 / DB_COORD_SCALE
+    rounding = POINTS_PER_STROKE * W_SHAPE / DB_COORD_SCALE
+    for c in prange(len(first_rows)):
+        n_db = counts[c]
+        row_sum = 0.0
+        col_min = np.full(n_db, np.inf)
+        for i in range(n_user):
+            row_min = np.inf
+            for j in range(n_db):
+                row = first_rows[c] + j
+                dx = u_features[i, 0] - db_features[row, 0]
+                dy = u_features[i, 1] - db_features[row, 1]
+                pair = (w_centroid * np.sqrt(dx * dx + dy * dy) +
+                        W_SIZE * abs(u_features[i, 2] - db_features[row, 2]) - rounding)
+                row_min = min(row_min, pair)
+                col_min[j] = min(col_min[j], pair)
+            row_sum += row_min
+        bound = 0.0
+        if n_user <= n_db:
+            bound = row_sum
+        if n_db <= n_user:
+            bound = max(bound, col_min.sum())
+        out[c] = bound * (1.0 - 1e-5)
+
+
+TENSOR_CACHE_KEYS = ('db_strokes', 'db_stroke_features', 'db_stroke_offsets', 'db_chars', 'db_stroke_counts')
+
+
+def _stroke_features(norm_strokes: np.ndarray) -> np.ndarray:
+    """
+    Фичи штрихов сразу для всех штрихов, без цикла по штрихам.
+
+    :param norm_strokes: Нормализованные штрихи (S, 32, 2).
+    :return: Массив (S, 3) float32: [CentroidX, CentroidY, Length].
+    """
+    feats = np.empty((len(norm_strokes), 3), dtype=np.float32)
+    feats[:, :2] = norm_strokes.mean(axis=1)
+    seg = np.diff(norm_strokes, axis=1)
+    feats[:, 2] = np.sqrt(np.einsum('...i,...i->...', seg, seg)).sum(axis=1)
+    return feats
+
+
+def tensor_cache_path(database_path: str) -> str:
+    """Путь к .npz-кэшу тензоров, который лежит рядом с .pkl базой."""
+    return os.path.splitext(database_path)[0] + '.npz'
+
+
+def build_tensor_cache(database: dict[str, NormalizedKanji]) -> dict[str, np.ndarray]:
+    """
+    Построение тензоров базы, с которыми работает Matcher.
+
+    :param database: Словарь {иероглиф: NormalizedKanji}.
+    :return: Словарь массивов с ключами TENSOR_CACHE_KEYS.
+
+    * Примечание: Штрихи всех иероглифов лежат подряд без padding (CSR-раскладка):
+    штрихи иероглифа i - это строки db_stroke_offsets[i]:db_stroke_offsets[i + 1].
+    """
+    chars_list, kanji_strokes = [], []
+    for char, kanji in database.items():
+        raw_strokes = [np.asarray(s, dtype=np.float32).reshape(-1, 2) for s in kanji.normalized_strokes]
+        if not raw_strokes: continue
+        chars_list.append(char)
+        kanji_strokes.append(raw_strokes)
+    all_strokes = [s for raw_strokes in kanji_strokes for s in raw_strokes]
+    counts = np.array([len(raw_strokes) for raw_strokes in kanji_strokes], dtype=np.int32)
+
+    point_offsets = np.zeros(len(all_strokes) + 1, dtype=np.int64)
+    np.cumsum([len(s) for s in all_strokes], out=point_offsets[1:])
+    kanji_offsets = np.zeros(len(counts) + 1, dtype=np.int64)
+    np.cumsum(counts, out=kanji_offsets[1:])
+    norm_strokes = _resample_and_normalize_batch(
+        np.concatenate(all_strokes), point_offsets, kanji_offsets, POINTS_PER_STROKE)
+
+    # В базе остаются первые MAX_STROKES_IN_DB штрихов каждого иероглифа
+    stroke_index = np.arange(len(norm_strokes)) - np.repeat(kanji_offsets[:-1], counts)
+    norm_strokes = norm_strokes[stroke_index < MAX_STROKES_IN_DB]
+    stroke_offsets = np.zeros(len(counts) + 1, dtype=np.int64)
+    np.cumsum(np.minimum(counts, MAX_STROKES_IN_DB), out=stroke_offsets[1:])
+
+    # Фичи считаются сразу для всех штрихов
+    feats = _stroke_features(norm_strokes)
+    return {
+        'db_strokes': np.round(norm_strokes * DB_COORD_SCALE).astype(np.int16),
+        'db_stroke_features': feats,
+        'db_stroke_offsets': stroke_offsets,
+        'db_chars': np.array(chars_list),
+        'db_stroke_counts': counts,
+    }
+
+
+def save_tensor_cache(database: dict[str, NormalizedKanji], path: str):
+    """Сохраняет тензоры базы в .npz, чтобы Matcher стартовал без pickle и сборки кэшей."""
+    np.savez(path, version=TENSOR_CACHE_VERSION, **build_tensor_cache(database))
+
+
+def _no_results() -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Пустой результат Matcher.recognize_arrays."""
+    return np.empty(0, dtype=np.str_), np.empty(0), np.empty(0)
+
+
 class Matcher:
     def __init__(self, database_path: str):
-        self.database: dict[str, NormalizedKanji] = self._load_database(database_path)
-        
         # Кэши для быстрого доступа
-        self.db_tensor = None      # (N, MaxS, 32, 2) - геометрия
-        self.db_features = None    # (N, MaxS, 4) - фичи: [CentroidX, CentroidY, Length]
+        self.db_strokes = None            # (S, 32, 2) int16 - штрихи всех иероглифов подряд, в единицах DB_COORD_SCALE
+        self.db_stroke_features = None    # (S, 3) - фичи штрихов: [CentroidX, CentroidY, Length]
+        self.db_stroke_offsets = None     # (N + 1,) - границы штрихов каждого иероглифа в db_strokes
         self.db_chars = []
         self.db_stroke_counts = []
         
-        self._build_internal_caches()
-        print(f"Matcher initialized with {len(self.database)} kanji entries. (High-Accuracy Mode)")
+        # Готовый .npz-кэш рядом с базой избавляет от pickle.load и пересборки тензоров
+        if not self._load_tensor_cache(tensor_cache_path(database_path), database_path):
+            self._build_internal_caches(self._load_database(database_path))
+        self._parallel_guard = self._parallel_kernel_guard()
+        print(f"Matcher initialized with {len(self.db_chars)} kanji entries. (High-Accuracy Mode)")
+
+    def _parallel_kernel_guard(self):
+        """
+        Контекст, в котором вызываются параллельные ядра (_cost_tensor, _assignment_lower_bound).
+
+        :return: _WORKQUEUE_LOCK для слоя потоков workqueue, иначе пустой контекст.
+
+        * Примечание: Слои tbb и omp допускают одновременный запуск параллельных ядер из разных
+        потоков, workqueue - нет, и без блокировки такие вызовы из пула потоков сервера небезопасны.
+        workqueue остаётся единственным слоем, если в системе нет ни TBB, ни OpenMP. Слой выбирается
+        при первом запуске параллельного ядра, поэтому здесь ядро запускается на пустых данных.
+        """
+        _assignment_lower_bound(np.empty((0, 3), dtype=np.float32), self.db_stroke_features,
+                                np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64), np.empty(0))
+        if numba.threading_layer() == 'workqueue':
+            return _WORKQUEUE_LOCK
+        return nullcontext()
 
     def _load_database(self, path: str):
         try:
-            with open(path, 'rb') as f:
-                return pickle.load(f)
+            return load_database(path)
         except FileNotFoundError:
             raise RuntimeError(f"Database file not found at '{path}'. Please run the preprocessor first.")
         except Exception as e:
@@ -45,10 +345,27 @@ class Matcher:
             predictive_mode: Если False (по умолчанию), сравнивает только с иероглифами
                              с таким же числом штрихов. Если True, ищет среди более сложных.
         """
+        chars, distances, confidences = self.recognize_arrays(user_drawing, top_n, predictive_mode)
+        return [
+            RecognitionResult(character=char, distance=dist, confidence=confidence)
+            for char, dist, confidence in zip(chars.tolist(), distances.tolist(), confidences.tolist())
+        ]
+
+    def recognize_arrays(self, user_drawing: NormalizedKanji, top_n: int = 5,
+                         predictive_mode: bool = False) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        То же, что recognize, но результаты возвращаются массивами, без объекта на каждый результат.
+
+        :param user_drawing: Объект NormalizedKanji от пользователя.
+        :param top_n: Количество результатов.
+        :param predictive_mode: Режим предикшна (см. recognize).
+        :return: (иероглифы, расстояния, уверенности) - массивы (n,) в порядке возрастания расстояния;
+                 расстояния округлены до 2 знаков, уверенности - до 4.
+        """
 
         # Подготовка данных пользователя
         user_tensor, user_features, user_count = self._preprocess_user_input(user_drawing)
-        if user_count == 0: return []
+        if user_count == 0: return _no_results()
 
         # Фильтрация кандидатов по числу штрихов
         if predictive_mode:
@@ -58,129 +375,161 @@ class Matcher:
         
         # Получение индексов кандидатов
         candidate_indices = np.where(mask)[0]
-        if len(candidate_indices) == 0: return []
-
-        scores = []
-
-        # Вычисление расстояний для каждого кандидата
-        for global_idx in candidate_indices:
-            db_count = self.db_stroke_counts[global_idx]
-            
-            cost = self._calculate_distance(user_tensor, user_features, global_idx)
-            
-            # Применение штрафа за лишние штрихи в режиме предикшна
-            if predictive_mode:
-                stroke_diff = db_count - user_count
-                cost *= (1 + stroke_diff * STROKE_COUNT_PENALTY)
-                
-            scores.append((global_idx, cost))
-
-        scores.sort(key=lambda item: item[1])
-        
-        results = []
-        if not scores: return []
-        
-        min_distance = scores[0][1] + 1e-6
-
-        for glob_idx, dist in scores[:top_n]:
-            char = self.db_chars[glob_idx]
-            
-            if dist <= min_distance:
-                confidence = 1.0
-            else:
-                confidence = min_distance / dist
-            
-            results.append(RecognitionResult(
-                character=char,
-                distance=round(float(dist), 2),
-                confidence=round(float(confidence), 4)
-            ))
-            
-        return results
-
-    def _calculate_distance(self, u_tensor, u_features, db_index):
-        """
-        Логика cost_matrix + linear_sum_assignment.
+        if len(candidate_indices) == 0: return _no_results()
+
+        # Штраф за лишние штрихи в режиме предикшна
+        if predictive_mode:
+            stroke_diff = self.db_stroke_counts[candidate_indices] - user_count
+            penalty = 1 + stroke_diff * STROKE_COUNT_PENALTY
+        else:
+            penalty = np.ones(len(candidate_indices))
+
+        # Вычисление расстояний; кандидаты, которые заведомо не войдут в top_n, не считаются
+        costs = self._calculate_top_costs(user_tensor, user_features, candidate_indices, penalty, top_n)
+
+        # Порядок не зависит от деления на число штрихов, поэтому среднее считается только для top_n;
+        # при равенстве стоимостей порядок как у стабильной сортировки - по индексу кандидата
+        if 0 < top_n < len(costs):
+            top = np.argpartition(costs, top_n - 1)[:top_n]
+            order = top[np.lexsort((top, costs[top]))]
+        else:
+            order = np.argsort(costs, kind='stable')[:top_n]
+        if len(order) == 0: return _no_results()
+        top_distances = costs[order] / user_count
+
+        # Уверенность = min_distance / dist, для dist <= min_distance ровно 1.0
+        min_distance = top_distances[0] + 1e-6
+        confidences = min_distance / np.maximum(top_distances, min_distance)
+        chars = self.db_chars[candidate_indices[order]]
+
+        return chars, np.round(top_distances, 2), np.round(confidences, 4)
+
+    def _calculate_top_costs(self, u_tensor, u_features, candidate_indices, penalty, top_n):
+        """
+        Стоимости кандидатов со штрафом, точные для всех, кто может попасть в top_n.
+
+        :param u_tensor: Тензор штрихов пользователя (M, 32, 2).
+        :param u_features: Фичи штрихов пользователя (M, 3).
+        :param candidate_indices: Индексы иероглифов-кандидатов в базе данных (C,).
+        :param penalty: Множитель стоимости для каждого кандидата (C,).
+        :param top_n: Сколько лучших кандидатов нужно.
+        :return: Массив (C,) стоимостей; у отсечённых кандидатов - inf.
+
+        * Примечание: Сначала точно считаются BOUND_FIRST_BLOCK кандидатов с наименьшей нижней
+        оценкой (_assignment_lower_bound), затем - только те, чья оценка не больше top_n-й
+        найденной стоимости. Остальные дороже неё и в top_n не попадут, поэтому результат
+        тот же, что при полном переборе.
+        """
+        costs = np.full(len(candidate_indices), np.inf)
+        if not 0 < top_n < len(candidate_indices):
+            costs[:] = self._calculate_distances(u_tensor, u_features, candidate_indices) * penalty
+            return costs
+
+        first_rows = self.db_stroke_offsets[candidate_indices]
+        counts = self.db_stroke_offsets[candidate_indices + 1] - first_rows
+        bounds = np.empty(len(candidate_indices))
+        with self._parallel_guard:
+            _assignment_lower_bound(np.ascontiguousarray(u_features, dtype=np.float32),
+                                    self.db_stroke_features, first_rows, counts, bounds)
+        bounds *= penalty
+        by_bound = np.argsort(bounds, kind='stable')
+
+        first = by_bound[:max(top_n, BOUND_FIRST_BLOCK)]
+        costs[first] = self._calculate_distances(u_tensor, u_features, candidate_indices[first]) * penalty[first]
+        threshold = np.partition(costs[first], top_n - 1)[top_n - 1]
+
+        rest = by_bound[len(first):]
+        rest = rest[bounds[rest] <= threshold]
+        if len(rest):
+            costs[rest] = self._calculate_distances(u_tensor, u_features, candidate_indices[rest]) * penalty[rest]
+        return costs
+
+    def _calculate_distances(self, u_tensor, u_features, candidate_indices):
+        """
+        Логика cost_matrix + linear_sum_assignment сразу для группы кандидатов.
 
         :param u_tensor: Тензор штрихов пользователя (M, 32, 2).
         :param u_features: Фичи штрихов пользователя (M, 3).
-        :param db_index: Индекс иероглифа в базе данных.
-        :return: Среднее расстояние после оптимального сопоставления штрихов.
+        :param candidate_indices: Индексы иероглифов-кандидатов в базе данных (C,).
+        :return: Массив (C,) суммарных стоимостей после оптимального сопоставления штрихов
+                 (для среднего по штрихам делится на M).
 
-        * Примечание: Возвращает бесконечность, если у пользователя больше штрихов, чем в базе.
+        * Примечание: У каждого кандидата должно быть не меньше штрихов, чем у пользователя.
         M - количество штрихов пользователя. 32 - количество точек на штрих. 2 - размерность точек (x, y).
         3 - количество фичей на штрих (CentroidX, CentroidY, Length).
+        Кандидаты группируются по числу штрихов K, и для группы строится тензор стоимостей (C, M, K)
+        скомпилированным ядром _cost_tensor; K - число штрихов кандидата в базе.
         constants W_SHAPE, W_POSITION, W_SIZE используются для взвешивания различных аспектов расстояния.
         """
 
-        # Получение количества штрихов в базе
-        db_count = self.db_stroke_counts[db_index]
         u_count = len(u_tensor)
-        
-        if u_count > db_count:
-            return float('inf')
-
-        # Извлечение данных из кэша
-        db_tensor = self.db_tensor[db_index][:db_count]
-        db_features = self.db_features[db_index][:db_count]
-
-        # Вычисление матриц расстояний по форме, позиции и размеру
-        diff = u_tensor[:, None, :, :] - db_tensor[None, :, :, :]
-        dist_shape = np.sum(np.linalg.norm(diff, axis=3), axis=2)
-        diff_rev = u_tensor[:, None, :, :] - db_tensor[None, :, ::-1, :]
-        dist_shape_rev = np.sum(np.linalg.norm(diff_rev, axis=3), axis=2)
-        final_dist_shape = np.minimum(dist_shape, dist_shape_rev)
-
-        # Позиционные различия
-        u_pos = u_features[:, :2]
-        db_pos = db_features[:, :2]
-        dist_pos = np.linalg.norm(u_pos[:, None, :] - db_pos[None, :, :], axis=2)
-
-        # Размерные различия
-        u_len = u_features[:, 2]
-        db_len = db_features[:, 2]
-        dist_size = np.abs(u_len[:, None] - db_len[None, :])
-
-        # Формирование итоговой матрицы стоимости
-        # Каждая ячейка представляет взвешенную сумму различий по форме, позиции и размеру
-        cost_matrix = (
-            (final_dist_shape * W_SHAPE) +
-            (dist_pos * W_POSITION) +
-            (dist_size * W_SIZE)
-        )
-
-        # Решение задачи оптимального сопоставления
-        # Использутся Hungarian Algorithm (linear_sum_assignment)
-        row_ind, col_ind = linear_sum_assignment(cost_matrix)
-        total_distance = cost_matrix[row_ind, col_ind].sum()
-
-        return total_distance / u_count
+        # Геометрия базы хранится в int16; пользователь переводится в те же единицы
+        u_scaled = u_tensor * np.float32(DB_COORD_SCALE)
+        u_features = np.ascontiguousarray(u_features, dtype=np.float32)
+        totals = np.empty(len(candidate_indices))
+
+        # Группы кандидатов с одинаковым числом штрихов: у всех их матриц стоимости одна форма (M, K)
+        first_rows = self.db_stroke_offsets[candidate_indices]
+        counts = self.db_stroke_offsets[candidate_indices + 1] - first_rows
+        by_count = np.argsort(counts, kind='stable')
+        buckets = np.split(by_count, np.flatnonzero(np.diff(counts[by_count])) + 1)
+
+        for bucket in buckets:
+            k = counts[bucket[0]]
+            cost_matrices = np.empty((len(bucket), u_count, k), dtype=np.float32)
+            with self._parallel_guard:
+                _cost_tensor(u_scaled, u_features, self.db_strokes, self.db_stroke_features,
+                             first_rows[bucket], cost_matrices)
+
+            # Решение задачи оптимального сопоставления для каждого кандидата
+            # Использутся Hungarian Algorithm (linear_sum_assignment); в цикле остаётся только
+            # сам решатель, а стоимости сопоставлений собираются одним индексированием на группу
+            n_pairs = min(u_count, k)
+            row_ind = np.empty((len(bucket), n_pairs), dtype=np.intp)
+            col_ind = np.empty((len(bucket), n_pairs), dtype=np.intp)
+            for i, cost_matrix in enumerate(cost_matrices):
+                row_ind[i], col_ind[i] = linear_sum_assignment(cost_matrix)
+            candidates = np.arange(len(bucket))[:, None]
+            totals[bucket] = cost_matrices[candidates, row_ind, col_ind].sum(axis=1)
+
+        return totals
 
     # Методы подготовки данных
-    def _build_internal_caches(self):
+    def _build_internal_caches(self, database: dict[str, NormalizedKanji]):
         """
         Построение кэшей для быстрого доступа к данным базы.
         """
-        tensor_list, feat_list, chars_list, counts_list = [], [], [], []
-        for char, kanji in self.database.items():
-            raw_strokes = [np.array(s, dtype=np.float32) for s in kanji.normalized_strokes]
-            if not raw_strokes: continue
-            norm_strokes = self._normalize_kanji_geometry(raw_strokes)
-            padded_geo = np.full((MAX_STROKES_IN_DB, POINTS_PER_STROKE, 2), np.nan, dtype=np.float32)
-            padded_feat = np.full((MAX_STROKES_IN_DB, 3), np.nan, dtype=np.float32)
-            for i, stroke in enumerate(norm_strokes[:MAX_STROKES_IN_DB]):
-                padded_geo[i] = stroke
-                centroid = np.mean(stroke, axis=0)
-                length = np.sum(np.linalg.norm(stroke[1:] - stroke[:-1], axis=1))
-                padded_feat[i] = [centroid[0], centroid[1], length]
-            tensor_list.append(padded_geo)
-            feat_list.append(padded_feat)
-            chars_list.append(char)
-            counts_list.append(len(norm_strokes))
-        self.db_tensor = np.array(tensor_list)
-        self.db_features = np.array(feat_list)
-        self.db_chars = np.array(chars_list)
-        self.db_stroke_counts = np.array(counts_list, dtype=np.int32)
+        self._set_tensors(build_tensor_cache(database))
+
+    def _load_tensor_cache(self, cache_path: str, database_path: str) -> bool:
+        """
+        Загрузка готовых тензоров из .npz-кэша (см. save_tensor_cache).
+
+        :return: True, если кэш загружен; False, если его нет, он старее базы или другой версии.
+        """
+        if not os.path.exists(cache_path):
+            return False
+        if os.path.exists(database_path) and os.path.getmtime(cache_path) < os.path.getmtime(database_path):
+            return False
+        try:
+            with np.load(cache_path) as data:
+                if data['version'] != TENSOR_CACHE_VERSION:
+                    return False
+                self._set_tensors({name: data[name] for name in TENSOR_CACHE_KEYS})
+        except (OSError, KeyError, ValueError):
+            return False
+        return True
+
+    def _set_tensors(self, tensors: dict[str, np.ndarray]):
+        """
+        Установка тензоров базы. Массивы приводятся к рабочим dtype и непрерывной раскладке
+        один раз здесь, чтобы в recognize не было ни конвертаций, ни strided-копий.
+        """
+        self.db_strokes = np.ascontiguousarray(tensors['db_strokes'], dtype=np.int16)
+        self.db_stroke_features = np.ascontiguousarray(tensors['db_stroke_features'], dtype=np.float32)
+        self.db_stroke_offsets = np.ascontiguousarray(tensors['db_stroke_offsets'], dtype=np.int64)
+        self.db_chars = np.asarray(tensors['db_chars'])
+        self.db_stroke_counts = np.ascontiguousarray(tensors['db_stroke_counts'], dtype=np.int32)
 
     def _preprocess_user_input(self, user_drawing):
         """
@@ -193,51 +542,27 @@ class Matcher:
         """
 
         # Преобразование штрихов пользователя в массивы numpy
-        raw_strokes = [np.array(s, dtype=np.float32) for s in user_drawing.normalized_strokes]
+        raw_strokes = [np.asarray(s, dtype=np.float32) for s in user_drawing.normalized_strokes]
         if not raw_strokes: return None, None, 0
-        norm_strokes = self._normalize_kanji_geometry(raw_strokes)
-        feats = []
+        user_tensor = np.empty((len(raw_strokes), POINTS_PER_STROKE, 2), dtype=np.float32)
+        norm_strokes = self._normalize_kanji_geometry(raw_strokes, out=user_tensor)
 
-        # Вычисление фич для каждого штриха
-        for s in norm_strokes:
-            centroid = np.mean(s, axis=0)
-            length = np.sum(np.linalg.norm(s[1:] - s[:-1], axis=1))
-            feats.append([centroid[0], centroid[1], length])
-        return np.array(norm_strokes), np.array(feats), len(norm_strokes)
+        # Фичи всех штрихов считаются тем же кодом, что и для базы
+        return norm_strokes, _stroke_features(norm_strokes), len(norm_strokes)
 
-    def _normalize_kanji_geometry(self, strokes):
+    def _normalize_kanji_geometry(self, strokes, out=None):
         """
         Нормализация геометрии и ресемплинг штрихов.
 
         :param strokes: Список штрихов (каждый - массив Nx2).
-        :return: Список нормализованных штрихов.
-        """
-        resampled = [self._resample_stroke(s) for s in strokes]
-        all_points = np.vstack(resampled)
-        min_xy = all_points.min(axis=0)
-        max_xy = all_points.max(axis=0)
-        max_dim = np.max(max_xy - min_xy)
-        if max_dim == 0: max_dim = 1.0
-        return [(s - min_xy) / max_dim for s in resampled]
-
-    def _resample_stroke(self, stroke, n=POINTS_PER_STROKE):
-        """
-        Ресемплинг штриха до n точек.
-
-        :param stroke: Массив Nx2 точек штриха.
-        :param n: Целевое количество точек.
-        :return: Массив n x 2 точек штриха.
-
-        * Примечание: Если штрих состоит из одной точки, возвращает n копий этой точки.
-        N - исходное количество точек штриха. N x 2 - размерность точек (x, y).
-        n - желаемое количество точек после ресемплинга. n x 2 - размерность точек после ресемплинга.
-        """
-        if len(stroke) == n: return stroke
-        dists = np.sqrt(np.sum(np.diff(stroke, axis=0)**2, axis=1))
-        cum_dist = np.insert(np.cumsum(dists), 0, 0)
-        total_len = cum_dist[-1]
-        if total_len == 0: return np.tile(stroke[0], (n, 1))
-        t = np.linspace(0, total_len, n)
-        x = np.interp(t, cum_dist, stroke[:, 0])
-        y = np.interp(t, cum_dist, stroke[:, 1])
-        return np.stack((x, y), axis=1)
\ No newline at end of file
+        :param out: Массив (S, n, 2) для результата. Если не задан, создаётся новый float32.
+        :return: Массив (S, n, 2) нормализованных штрихов (тот же out, если он передан).
+        """
+        if out is None:
+            out = np.empty((len(strokes), POINTS_PER_STROKE, 2), dtype=np.float32)
+        if len(strokes) == 0: return out
+        stroke_offsets = np.zeros(len(strokes) + 1, dtype=np.int64)
+        np.cumsum([len(s) for s in strokes], out=stroke_offsets[1:])
+        flat_points = np.concatenate(strokes).astype(np.float32, copy=False)
+        _resample_and_normalize_into(flat_points, stroke_offsets, out)
+        return out
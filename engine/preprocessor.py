@@ -1,26 +1,32 @@
 # Файл: engine/preprocessor.py
 
+import multiprocessing
 import os
-import pickle
+from dataclasses import replace
 import numpy as np
-from svgpathtools import parse_path
+from svgpathtools import CubicBezier, parse_path
 from tqdm import tqdm
 from .data_models import (
     KanjiComponent, NormalizedKanji, NormalizedStroke, StrokeFeatures,
     StrokeData, Point, BoundingBox
 )
 from .svg_parser import parse_svg_file
+from .matcher import save_tensor_cache, tensor_cache_path
+from .storage import full_database_path, save_database
+
+# Сколько SVG-файлов отдаётся процессу пула за один раз
+SVG_CHUNK_SIZE = 32
 
 def _calculate_stroke_features(stroke: NormalizedStroke) -> StrokeFeatures:
     """Вычисляет и возвращает все фичи для одного штриха."""
-    if not stroke:
+    if len(stroke) == 0:
         # Возвращаем "пустой" объект на случай пустого штриха
         return StrokeFeatures(
             bounding_box=((0, 0), (0, 0)), start_point=(0, 0), end_point=(0, 0),
             centroid=(0, 0), length=0.0
         )
         
-    points = np.array(stroke)
+    points = np.asarray(stroke, dtype=np.float64)
     
     # Bounding Box
     min_coords = tuple(points.min(axis=0))
@@ -42,7 +48,7 @@ def _get_global_features(all_strokes: list[NormalizedStroke]) -> tuple[BoundingB
     if not all_strokes:
         return (((0, 0), (0, 0)), (0, 0))
     
-    all_points = np.array([point for stroke in all_strokes for point in stroke])
+    all_points = np.concatenate(all_strokes, dtype=np.float64)
     if all_points.size == 0:
         return (((0, 0), (0, 0)), (0, 0))
         
@@ -54,30 +60,60 @@ def _get_global_features(all_strokes: list[NormalizedStroke]) -> tuple[BoundingB
 
 def _flatten_strokes(component: KanjiComponent) -> list[StrokeData]:
     """
-    Рекурсивно собирает все штрихи из дерева компонентов в один
-    плоский список, сохраняя их порядок.
+    Собирает все штрихи из дерева компонентов в один плоский список:
+    сначала штрихи компонента, затем штрихи дочерних компонентов по порядку.
+
+    * Примечание: Обход в глубину через явный стек, без рекурсивных вызовов. Порядок списка
+    не совпадает с порядком рисования (id_number), если у группы есть штрихи после
+    дочерней группы, поэтому вызывающий код сортирует штрихи по id_number.
     """
-    # Собираем штрихи текущего уровня
-    all_strokes = component.strokes[:]
-    # Рекурсивно собираем штрихи из дочерних компонентов
-    for child in component.children:
-        all_strokes.extend(_flatten_strokes(child))
+    all_strokes = []
+    stack = [component]
+    while stack:
+        node = stack.pop()
+        # Штрихи текущего уровня, затем дочерние компоненты в исходном порядке
+        all_strokes.extend(node.strokes)
+        stack.extend(reversed(node.children))
     return all_strokes
 
 
 def _sample_path(path_data: str, num_points: int = 32) -> NormalizedStroke:
     """
-    Преобразует строку SVG path в список из N точек (x, y).
+    Преобразует строку SVG path в массив из N точек (x, y).
+
+    * Примечание: Повторяет path.point(t) из svgpathtools для всех t сразу: t отображается
+    на сегмент по долям длины сегментов, а внутри сегмента - линейно в его параметр.
+    Кривые Безье вычисляются одним векторным выражением; пути не только из
+    кубических кривых (в KanjiVG не встречаются) и пути нулевой длины считаются через path.point.
     """
     path = parse_path(path_data)
-    points = []
-    for i in range(num_points):
-        # t - параметр от 0.0 до 1.0, обозначающий положение на кривой
-        t = i / (num_points - 1)
-        point = path.point(t)
-        # svgpathtools возвращает комплексные числа, где real=x, imag=y
-        points.append((point.real, point.imag))
-    return points
+    # t - параметр от 0.0 до 1.0, обозначающий положение на кривой
+    t = np.arange(num_points) / (num_points - 1)
+
+    is_cubic = all(isinstance(segment, CubicBezier) for segment in path)
+    lengths = [segment.length() for segment in path] if is_cubic else []
+    if not is_cubic or sum(lengths) == 0:
+        # svgpathtools возвращает комплексные числа, где real=x, imag=y;
+        # для пути нулевой длины path.point бросает RuntimeError, и файл пропускается
+        points = np.array([path.point(pos) for pos in t.tolist()])
+        return np.column_stack((points.real, points.imag))
+
+    segment_end = np.cumsum(np.array(lengths) / sum(lengths))
+    segment_start = np.concatenate(([0.0], segment_end[:-1]))
+
+    # Первый сегмент, конец которого не раньше t; t = 0 и t = 1 - начало первого и конец последнего.
+    # Сегмент нулевой длины выбирается только для t = 0, где local_t всё равно 0
+    index = np.minimum(np.searchsorted(segment_end, t), len(path) - 1)
+    span = segment_end[index] - segment_start[index]
+    local_t = np.divide(t - segment_start[index], span, out=np.zeros_like(t), where=span > 0)
+    index[-1], local_t[-1] = len(path) - 1, 1.0
+    local_t[0] = 0.0
+
+    # Кривая Безье по схеме Горнера, как в CubicBezier.point
+    p0, p1, p2, p3 = np.array([segment.bpoints() for segment in path])[index].T
+    points = p0 + local_t * (3 * (p1 - p0) + local_t * (
+        3 * (p0 + p2) - 6 * p1 + local_t * (-p0 + 3 * (p1 - p2) + p3)))
+    return np.column_stack((points.real, points.imag))
 
 
 def _normalize_kanji(strokes: list[NormalizedStroke]) -> list[NormalizedStroke]:
@@ -85,11 +121,13 @@ def _normalize_kanji(strokes: list[NormalizedStroke]) -> list[NormalizedStroke]:
     Масштабирует и центрирует иероглиф, чтобы он вписывался
     в условный квадрат 100x100.
     """
-    if not strokes or not any(strokes):
+    if not strokes:
         return []
 
     # сбор всех точек в один numpy массив для эффективных вычислений
-    all_points = np.array([point for stroke in strokes for point in stroke])
+    all_points = np.concatenate([np.asarray(stroke, dtype=np.float64).reshape(-1, 2) for stroke in strokes])
+    if all_points.size == 0:
+        return []
 
     min_coords = all_points.min(axis=0)
     max_coords = all_points.max(axis=0)
@@ -113,67 +151,91 @@ def _normalize_kanji(strokes: list[NormalizedStroke]) -> list[NormalizedStroke]:
     # сдвиг для центрирования
     points_normalized = points_scaled + offset
 
-    # точки обратно в структуру штрихов
-    normalized_strokes = []
-    start_index = 0
-    for stroke in strokes:
-        end_index = start_index + len(stroke)
-        normalized_strokes.append([tuple(p) for p in points_normalized[start_index:end_index].tolist()])
-        start_index = end_index
-        
-    return normalized_strokes
+    # точки обратно в структуру штрихов: по массиву float32 на штрих
+    split_indices = np.cumsum([len(stroke) for stroke in strokes])[:-1]
+    return np.split(points_normalized.astype(np.float32), split_indices)
+
+
+def _process_one_svg(filepath: str) -> tuple[str, NormalizedKanji] | None:
+    """
+    Обрабатывает один SVG-файл: парсинг, семплирование штрихов, нормализация и фичи.
+
+    :param filepath: Путь к SVG-файлу.
+    :return: Пара (иероглиф, NormalizedKanji) или None, если файл пропущен.
+
+    * Примечание: Функция верхнего уровня, чтобы её можно было передать в пул процессов.
+    """
+    filename = os.path.basename(filepath)
+    try:
+        root_component = parse_svg_file(filepath)
+
+        if not root_component.children:
+            print(f"⚠️  No child component found in {filename}, skipping.")
+            return None
+
+        character_component = root_component.children[0]
+        character = character_component.attributes.get('kvg:element')
+
+        if not character:
+            print(f"⚠️  No 'kvg:element' attribute on character group in {filename}, skipping.")
+            return None
+
+        all_raw_strokes = _flatten_strokes(root_component)
+        # Порядок обхода дерева - не порядок рисования (около трети файлов KanjiVG)
+        all_raw_strokes.sort(key=lambda s: s.id_number)
+
+        sampled_strokes = [_sample_path(stroke.path_data) for stroke in all_raw_strokes]
+        normalized = _normalize_kanji(sampled_strokes)
+
+        features_per_stroke = [_calculate_stroke_features(s) for s in normalized]
+
+        global_box, global_centroid = _get_global_features(normalized)
+
+        return character, NormalizedKanji(
+            character=character,
+            normalized_strokes=normalized,
+            stroke_features=features_per_stroke,
+            global_bounding_box=global_box,
+            global_centroid=global_centroid,
+            source_component_tree=root_component
+        )
+
+    except Exception as e:
+        print(f"❌ Error processing '{filename}': {e}")
+        return None
 
 
 def create_database(svg_dir: str, output_path: str):
     """
     Обрабатывает все SVG-файлы из директории, нормализует их
     и сохраняет в единый файл базы данных.
+
+    * Примечание: Файлы обрабатываются параллельно в пуле процессов. Результаты
+    собираются в исходном порядке файлов, чтобы порядок иероглифов в базе
+    (и выбор при равных расстояниях) не зависел от планирования процессов.
     """
     print(f"Starting preprocessing of SVG files in '{svg_dir}'...")
     
     kanji_database = {}
-    svg_files = [f for f in os.listdir(svg_dir) if f.endswith('.svg')]
-
-    for filename in tqdm(svg_files, desc="Processing SVGs", unit="file"):
-        filepath = os.path.join(svg_dir, filename)
-
-        try:
-            root_component = parse_svg_file(filepath)
-
-            if not root_component.children:
-                print(f"⚠️  No child component found in {filename}, skipping.")
-                continue
-            
-            character_component = root_component.children[0]
-            character = character_component.attributes.get('kvg:element')
-
-            if not character:
-                print(f"⚠️  No 'kvg:element' attribute on character group in {filename}, skipping.")
-                continue
-
-            all_raw_strokes = _flatten_strokes(root_component)
-            all_raw_strokes.sort(key=lambda s: s.id_number)
-            
-            sampled_strokes = [_sample_path(stroke.path_data) for stroke in all_raw_strokes]
-            normalized = _normalize_kanji(sampled_strokes)
-
-            features_per_stroke = [_calculate_stroke_features(s) for s in normalized]
-            
-            global_box, global_centroid = _get_global_features(normalized)
-
-            kanji_database[character] = NormalizedKanji(
-                character=character,
-                normalized_strokes=normalized,
-                stroke_features=features_per_stroke,
-                global_bounding_box=global_box,
-                global_centroid=global_centroid,
-                source_component_tree=root_component
-            )
-
-        except Exception as e:
-            print(f"❌ Error processing '{filename}': {e}")
-            continue
-    with open(output_path, 'wb') as f:
-        pickle.dump(kanji_database, f)
+    svg_files = [os.path.join(svg_dir, f) for f in os.listdir(svg_dir) if f.endswith('.svg')]
+
+    with multiprocessing.Pool() as pool:
+        results = pool.imap(_process_one_svg, svg_files, chunksize=SVG_CHUNK_SIZE)
+        for result in tqdm(results, total=len(svg_files), desc="Processing SVGs", unit="file"):
+            if result is not None:
+                character, kanji = result
+                kanji_database[character] = kanji
+
+    # Деревья компонентов нужны только для отладки и разбора структуры иероглифов:
+    # они сохраняются в отдельную полную базу, а в рабочей базе остаются None
+    save_database(kanji_database, full_database_path(output_path))
+    runtime_database = {
+        character: replace(kanji, source_component_tree=None)
+        for character, kanji in kanji_database.items()
+    }
+    save_database(runtime_database, output_path)
+
+    # Готовые тензоры для Matcher, чтобы сервер и клиенты стартовали без pickle
+    save_tensor_cache(runtime_database, tensor_cache_path(output_path))
         
     print(f"\n✅ Database created successfully at '{output_path}' with {len(kanji_database)} entries.")
\ No newline at end of file
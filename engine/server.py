@@ -1,12 +1,13 @@
 import grpc
 from concurrent import futures
 import time
+import numpy as np
 
 import recognition_pb2
 import recognition_pb2_grpc
 
 from engine.matcher import Matcher
-from engine.data_models import NormalizedKanji, StrokeFeatures
+from engine.data_models import NormalizedKanji, StrokeFeatures, STROKE_FEATURES_DTYPE
 
 DATABASE_PATH = 'assets/kanjivg_normalized.pkl'
 
@@ -29,30 +30,37 @@ class RecognitionServicer(recognition_pb2_grpc.RecognitionServiceServicer):
             context.set_details(f'Failed to parse request: {e}')
             return recognition_pb2.RecognitionResponse()
 
-        results = self.matcher.recognize(user_drawing, top_n=request.top_n)
+        chars, distances, confidences = self.matcher.recognize_arrays(user_drawing, top_n=request.top_n)
 
         response = recognition_pb2.RecognitionResponse()
-        for res in results:
-            response.results.add(
-                character=res.character,
-                distance=res.distance,
-                confidence=res.confidence
-            )
+        for char, distance, confidence in zip(chars.tolist(), distances.tolist(), confidences.tolist()):
+            response.results.add(character=char, distance=distance, confidence=confidence)
         
         return response
 
     def _convert_request_to_kanji(self, request: recognition_pb2.RecognitionRequest) -> NormalizedKanji:
         """Вспомогательный метод для конвертации типов."""
-        strokes = [[(p.x, p.y) for p in s.points] for s in request.normalized_strokes]
-        
+        # np.frombuffer не копирует данные: штрихи - это срезы исходного буфера запроса
+        points = np.frombuffer(request.strokes_blob, dtype='<f4').reshape(-1, 2)
+        lengths = np.asarray(request.stroke_lengths, dtype=np.int64)
+        if (lengths <= 0).any():
+            raise ValueError("stroke_lengths must be positive: an empty stroke cannot be resampled")
+        if lengths.sum() != len(points):
+            raise ValueError(f"stroke_lengths sum to {lengths.sum()}, but strokes_blob holds {len(points)} points")
+        strokes = np.split(points, np.cumsum(lengths)[:-1]) if len(lengths) else []
+
+        records = np.frombuffer(request.stroke_features_blob, dtype=STROKE_FEATURES_DTYPE)
         features = [
             StrokeFeatures(
-                bounding_box=((f.bounding_box.min.x, f.bounding_box.min.y), (f.bounding_box.max.x, f.bounding_box.max.y)),
-                start_point=(f.start_point.x, f.start_point.y),
-                end_point=(f.end_point.x, f.end_point.y),
-                centroid=(f.centroid.x, f.centroid.y),
-                length=f.length
-            ) for f in request.stroke_features
+                bounding_box=(tuple(bbox_min), tuple(bbox_max)),
+                start_point=tuple(start),
+                end_point=tuple(end),
+                centroid=tuple(centroid),
+                length=length
+            ) for length, start, end, centroid, bbox_min, bbox_max in zip(
+                records['length'].tolist(), records['start'].tolist(), records['end'].tolist(),
+                records['centroid'].tolist(), records['bbox_min'].tolist(), records['bbox_max'].tolist()
+            )
         ]
         
         g_box = ((request.global_bounding_box.min.x, request.global_bounding_box.min.y), 
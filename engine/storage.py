@@ -0,0 +1,105 @@
+# Файл: engine/storage.py
+
+import gc
+import os
+import pickle
+import zlib
+import numpy as np
+from .data_models import NormalizedKanji
+
+# Выравнивание буферов в файле-спутнике, чтобы массивы numpy после загрузки были выровнены
+BUFFER_ALIGNMENT = 64
+
+
+def buffers_path(database_path: str) -> str:
+    """Путь к файлу-спутнику с данными массивов numpy, который лежит рядом с .pkl базой."""
+    return os.path.splitext(database_path)[0] + '.buffers'
+
+
+def full_database_path(database_path: str) -> str:
+    """Путь к полной базе с деревьями компонентов, которая лежит рядом с рабочей .pkl базой."""
+    return os.path.splitext(database_path)[0] + '_full.pkl'
+
+
+def save_database(database: dict[str, NormalizedKanji], path: str):
+    """
+    Сохранение базы в pickle protocol 5.
+
+    :param database: Словарь {иероглиф: NormalizedKanji}.
+    :param path: Путь к .pkl файлу.
+
+    * Примечание: Данные массивов numpy не копируются в pickle, а передаются вне потока
+    (PickleBuffer) и пишутся одним файлом-спутником (см. buffers_path).
+    Формат спутника: int64 [n, crc32 pickle, offsets[n], sizes[n]], затем выровненные буферы.
+    Оба файла пишутся во временные и переименовываются: сначала спутник, затем pickle.
+    """
+    buffers = []
+    data = pickle.dumps(database, protocol=5, buffer_callback=buffers.append)
+
+    raw_buffers = [b.raw() for b in buffers]
+    sizes = np.array([b.nbytes for b in raw_buffers], dtype=np.int64)
+    padded = -(-sizes // BUFFER_ALIGNMENT) * BUFFER_ALIGNMENT
+    data_start = -(-8 * (2 + 2 * len(sizes)) // BUFFER_ALIGNMENT) * BUFFER_ALIGNMENT
+    offsets = data_start + np.cumsum(padded) - padded
+
+    sidecar = buffers_path(path)
+    with open(sidecar + '.tmp', 'wb') as f:
+        f.write(np.concatenate([[len(sizes), zlib.crc32(data)], offsets, sizes]).astype(np.int64).tobytes())
+        for offset, raw in zip(offsets.tolist(), raw_buffers):
+            f.seek(offset)
+            f.write(raw)
+    os.replace(sidecar + '.tmp', sidecar)
+
+    with open(path + '.tmp', 'wb') as f:
+        f.write(data)
+    os.replace(path + '.tmp', path)
+
+
+def load_database(path: str) -> dict[str, NormalizedKanji]:
+    """
+    Загрузка базы, сохранённой save_database.
+
+    :param path: Путь к .pkl файлу.
+    :return: Словарь {иероглиф: NormalizedKanji}.
+
+    * Примечание: Массивы numpy ссылаются на память одного прочитанного файла-спутника без
+    копирования. Если спутника нет (база старого формата), pickle читается как обычно.
+    Спутник от другой сборки (другой crc32 pickle или другое число буферов) - ошибка ValueError.
+    Сборщик мусора на время загрузки отключается: pickle создаёт сотни тысяч объектов,
+    и циклические проходы gc по ним занимают больше времени, чем само чтение.
+    """
+    with open(path, 'rb') as f:
+        data = f.read()
+    sidecar = buffers_path(path)
+    buffers = iter(_read_buffers(sidecar, zlib.crc32(data))) if os.path.exists(sidecar) else None
+
+    gc_was_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        database = pickle.loads(data, buffers=buffers)
+    finally:
+        if gc_was_enabled:
+            gc.enable()
+    if buffers is not None and next(buffers, None) is not None:
+        raise ValueError(f"'{sidecar}' holds more buffers than '{path}' refers to")
+    return database
+
+
+def _read_buffers(path: str, pickle_crc: int) -> list[memoryview]:
+    """
+    Чтение буферов из файла-спутника (формат см. в save_database).
+
+    :param path: Путь к файлу-спутнику.
+    :param pickle_crc: crc32 байтов pickle, к которому спутник должен относиться.
+    :return: Список буферов в порядке, в котором их запрашивает pickle.
+
+    * Примечание: Заголовок - int64 [n, crc32 pickle, offsets[n], sizes[n]]; буферы - срезы
+    одного прочитанного массива, без копирования.
+    """
+    data = np.fromfile(path, dtype=np.uint8)
+    count, crc = data[:16].view(np.int64).tolist()
+    if crc != pickle_crc:
+        raise ValueError(f"'{path}' was written for a different pickle; rebuild the database")
+    header = data[16:16 + 16 * count].view(np.int64)
+    view = memoryview(data)
+    return [view[offset:offset + size] for offset, size in zip(header[:count].tolist(), header[count:].tolist())]